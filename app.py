@@ -1,22 +1,53 @@
+import asyncio
+import os
 import shutil
 import tempfile
+import time
 import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, Request, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 
 from nmc_extract import extract_nmc_pin
-from nmc_runner import run_nmc_check_and_download_pdf
-from pdf_utils import make_simple_error_pdf
+from nmc_runner import run_nmc_check_and_download_pdf, shutdown_browsers, warm_up_browsers
+from pdf_utils import make_simple_error_pdf_bytes
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_ROOT = BASE_DIR / "data"
 DATA_ROOT.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI()
+# Uploads and job PDFs only live for one request. Disk-backed by default; set
+# NMC_TMP (e.g. /dev/shm/nmc) to put them on a tmpfs sized for the upload load.
+TMP_ROOT = Path(os.getenv("NMC_TMP") or str(DATA_ROOT))
+TMP_ROOT.mkdir(parents=True, exist_ok=True)
+
+# Successful register PDFs are reused for repeat checks of the same PIN
+# (LRU, bounded by entry count as well as by TTL).
+NMC_PIN_CACHE_TTL = int(os.getenv("NMC_PIN_CACHE_TTL", "600"))
+NMC_PIN_CACHE_SIZE = int(os.getenv("NMC_PIN_CACHE_SIZE", "64"))
+_pin_pdf_cache: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    try:
+        await warm_up_browsers()
+    except Exception:
+        # Checks launch on demand anyway; don't block startup on a browser issue
+        pass
+    try:
+        yield
+    finally:
+        await shutdown_browsers()
+
+
+app = FastAPI(lifespan=_lifespan)
 
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
@@ -34,19 +65,99 @@ def health():
 
 def _new_job_dir() -> Path:
     job_id = f"nmc_{uuid.uuid4().hex}"
-    job_dir = DATA_ROOT / job_id
+    job_dir = TMP_ROOT / job_id
     job_dir.mkdir(parents=True, exist_ok=True)
     return job_dir
 
 
+UPLOAD_COPY_BUFSIZE = 1 << 20
+
+
 def _save_upload(upload: UploadFile) -> Path:
     suffix = Path(upload.filename or "").suffix.lower()
-    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
-    Path(tmp_path).unlink(missing_ok=True)
-    tmp = Path(tmp_path)
-    with tmp.open("wb") as f:
-        shutil.copyfileobj(upload.file, f)
-    return tmp
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=str(TMP_ROOT)) as f:
+        shutil.copyfileobj(upload.file, f, length=UPLOAD_COPY_BUFSIZE)
+    return Path(f.name)
+
+
+def _pdf_response(pdf_path: Path, job_dir: Path) -> FileResponse:
+    """Serve a job PDF and remove the job directory once the body has been sent."""
+    return FileResponse(
+        str(pdf_path),
+        media_type="application/pdf",
+        filename=pdf_path.name,
+        background=BackgroundTask(shutil.rmtree, job_dir, ignore_errors=True),
+    )
+
+
+def _error_pdf_response(filename: str, lines: List[str], job_dir: Optional[Path] = None) -> Response:
+    """Error PDF rendered in memory; nothing is written to the job directory."""
+    return Response(
+        content=make_simple_error_pdf_bytes(title="NMC check failed", lines=lines),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(shutil.rmtree, job_dir, ignore_errors=True) if job_dir else None,
+    )
+
+
+def _cached_pdf_response(pin: str) -> Optional[Response]:
+    hit = _pin_pdf_cache.get(pin)
+    if not hit:
+        return None
+    expires, filename, data = hit
+    if expires < time.time():
+        _pin_pdf_cache.pop(pin, None)
+        return None
+    _pin_pdf_cache.move_to_end(pin)
+    return Response(
+        content=data,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _remember_pdf(pin: str, result: dict, pdf_path: Path) -> None:
+    if NMC_PIN_CACHE_TTL <= 0 or NMC_PIN_CACHE_SIZE <= 0 or not result.get("ok"):
+        return
+    now = time.time()
+    for k in [k for k, (exp, _, _) in _pin_pdf_cache.items() if exp < now]:
+        _pin_pdf_cache.pop(k, None)
+    try:
+        _pin_pdf_cache[pin] = (now + NMC_PIN_CACHE_TTL, pdf_path.name, pdf_path.read_bytes())
+    except OSError:
+        return
+    _pin_pdf_cache.move_to_end(pin)
+    while len(_pin_pdf_cache) > NMC_PIN_CACHE_SIZE:
+        _pin_pdf_cache.popitem(last=False)
+
+
+async def _check_pin_response(pin: str) -> Response:
+    """Run the register check for a PIN and return the PDF (official or error).
+
+    The job directory is removed by a BackgroundTask once the response body
+    has been sent, or right away if the check raises.
+    """
+    cached = _cached_pdf_response(pin)
+    if cached is not None:
+        return cached
+
+    job_dir = _new_job_dir()
+    try:
+        result = await run_nmc_check_and_download_pdf(nmc_pin=pin, out_dir=str(job_dir))
+        pdf_path = Path(result.get("pdf_path") or "")
+
+        if not pdf_path.exists():
+            return _error_pdf_response(
+                "NMC-Error-Internal.pdf",
+                ["The check could not generate a PDF.", "Please try again."],
+                job_dir,
+            )
+
+        _remember_pdf(pin, result, pdf_path)
+        return _pdf_response(pdf_path, job_dir)
+    except BaseException:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
 
 
 
@@ -55,9 +166,9 @@ from fastapi.responses import JSONResponse
 @app.post("/extract")
 async def extract_only(file: UploadFile = File(...)):
     """Extract NMC PIN only. Returns JSON so user can review/edit."""
-    tmp = _save_upload(file)
+    tmp = await asyncio.to_thread(_save_upload, file)
     try:
-        extracted = extract_nmc_pin(tmp)
+        extracted = await extract_nmc_pin(tmp)
     finally:
         tmp.unlink(missing_ok=True)
 
@@ -70,30 +181,13 @@ async def extract_only(file: UploadFile = File(...)):
 async def run_by_pin(payload: dict):
     """Run NMC automation using an already-known PIN (PDF-only response)."""
     pin = (payload.get("nmc_pin") or "").strip().upper()
-    job_dir = _new_job_dir()
-
     if not pin:
-        out = job_dir / "NMC-Error-Missing-PIN.pdf"
-        make_simple_error_pdf(
-            out_path=out,
-            title="NMC check failed",
-            lines=["Missing NMC PIN.", "Please enter a valid PIN and try again."],
+        return _error_pdf_response(
+            "NMC-Error-Missing-PIN.pdf",
+            ["Missing NMC PIN.", "Please enter a valid PIN and try again."],
         )
-        return FileResponse(str(out), media_type="application/pdf", filename=out.name)
 
-    result = await run_nmc_check_and_download_pdf(nmc_pin=pin, out_dir=str(job_dir))
-    pdf_path = Path(result.get("pdf_path") or "")
-
-    if not pdf_path.exists():
-        out = job_dir / "NMC-Error-Internal.pdf"
-        make_simple_error_pdf(
-            out_path=out,
-            title="NMC check failed",
-            lines=["The check could not generate a PDF.", "Please try again."],
-        )
-        return FileResponse(str(out), media_type="application/pdf", filename=out.name)
-
-    return FileResponse(str(pdf_path), media_type="application/pdf", filename=pdf_path.name)
+    return await _check_pin_response(pin)
 
 
 
@@ -105,40 +199,20 @@ async def run_nmc(file: UploadFile = File(...)):
     - Run NMC automation and download official PDF
     - Always returns a PDF (official or error PDF)
     """
-    job_dir = _new_job_dir()
-
-    tmp = _save_upload(file)
+    tmp = await asyncio.to_thread(_save_upload, file)
     try:
-        extracted = extract_nmc_pin(tmp)
+        extracted = await extract_nmc_pin(tmp)
     finally:
         tmp.unlink(missing_ok=True)
 
     pin = (extracted.get("nmc_pin") or "").strip().upper()
     if not pin:
-        out = job_dir / "NMC-Error-Extraction.pdf"
-        make_simple_error_pdf(
-            out_path=out,
-            title="NMC check failed",
-            lines=[
+        return _error_pdf_response(
+            "NMC-Error-Extraction.pdf",
+            [
                 "Unable to extract NMC PIN from the uploaded document.",
                 "Please upload a clearer NMC document (PDF/image) that contains the PIN.",
             ],
         )
-        return FileResponse(str(out), media_type="application/pdf", filename=out.name)
-
-    result = await run_nmc_check_and_download_pdf(nmc_pin=pin, out_dir=str(job_dir))
-    pdf_path = Path(result.get("pdf_path") or "")
-
-    if not pdf_path.exists():
-        out = job_dir / "NMC-Error-Internal.pdf"
-        make_simple_error_pdf(
-            out_path=out,
-            title="NMC check failed",
-            lines=[
-                "The check could not generate a PDF.",
-                "Please try again.",
-            ],
-        )
-        return FileResponse(str(out), media_type="application/pdf", filename=out.name)
 
-    return FileResponse(str(pdf_path), media_type="application/pdf", filename=pdf_path.name)
+    return await _check_pin_response(pin)
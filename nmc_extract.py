@@ -1,17 +1,14 @@
+import asyncio
+import functools
+import hashlib
 import os
 import re
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Tuple
+from typing import TYPE_CHECKING, Optional, Dict, Any, Iterator, List, Tuple
 
-import pdfplumber
-import fitz  # PyMuPDF
-
-try:
-    from google import genai
-    from google.genai import types
-except Exception:
-    genai = None
-    types = None
+if TYPE_CHECKING:
+    import fitz  # PyMuPDF, imported lazily at runtime via _fitz()
 
 # ------------------------------------------------------------
 # NMC PIN extraction (production-safe)
@@ -29,8 +26,7 @@ except Exception:
 STRICT_NMC_RE = re.compile(r"\b\d{2}[A-L]\d{4}[ESWNO]\b", re.I)
 LOOSE_8_RE = re.compile(r"\b\d{2}[A-Z]\d{4}[A-Z]\b", re.I)
 
-ANCHOR_RE = re.compile(
-    r"("
+_ANCHOR_PATTERN = (
     r"NMC\s*PIN"
     r"|NMC\s*PIN\s*NUMBER"
     r"|PIN\s*NUMBER"
@@ -40,23 +36,66 @@ ANCHOR_RE = re.compile(
     r"|REGISTRATION\s*NUMBER"
     r"|NMC\s*REGISTRATION\s*NUMBER"
     r"|PERSONAL\s*IDENTIFICATION\s*NUMBER"
-    r")",
+)
+
+# One pass over the text finds labels, strict PINs and loose 8-char candidates.
+# Strict is tried before loose, so a loose hit is never also a strict one.
+FUSED_RE = re.compile(
+    rf"(?P<anchor>{_ANCHOR_PATTERN})"
+    rf"|(?P<strict>{STRICT_NMC_RE.pattern})"
+    rf"|(?P<loose>{LOOSE_8_RE.pattern})",
     re.I
 )
 
+_ANCHOR_WINDOW = 120
+# Page-join overlap: longest label plus its value window
+_SEAM_CHARS = _ANCHOR_WINDOW + 40
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
 GEMINI_MODEL_FAST = os.getenv("GEMINI_MODEL_FAST", "gemini-2.0-flash")
 GEMINI_MODEL_STRONG = os.getenv("GEMINI_MODEL_STRONG", "gemini-2.5-pro")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
 
 NMC_PDF_TEXT_PAGES = int(os.getenv("NMC_PDF_TEXT_PAGES", "8"))
 NMC_PDF_IMAGE_PAGES = int(os.getenv("NMC_PDF_IMAGE_PAGES", "4"))
+NMC_PDF_IMAGE_DPI = int(os.getenv("NMC_PDF_IMAGE_DPI", "150"))
+# Fraction of the page height (from the top) sent to Gemini; 1.0 = whole page.
+# Below 1.0, pages are retried whole when the clipped pass finds no PIN.
+NMC_PDF_IMAGE_CLIP = min(max(float(os.getenv("NMC_PDF_IMAGE_CLIP", "1.0")), 0.1), 1.0)
+NMC_MAX_SCAN_CHARS = int(os.getenv("NMC_MAX_SCAN_CHARS", "4096"))
+NMC_EXTRACT_CACHE_SIZE = int(os.getenv("NMC_EXTRACT_CACHE_SIZE", "1024"))
+
+
+# --- lazy heavy imports -------------------------------------------------------
+# PyMuPDF and google-genai are only imported (and the Gemini client only
+# created) the first time a request needs them.
+
+@functools.lru_cache(maxsize=None)
+def _fitz():
+    import fitz  # PyMuPDF
+    return fitz
+
+
+@functools.lru_cache(maxsize=None)
+def _genai_types():
+    try:
+        from google.genai import types
+    except Exception:
+        return None
+    return types
 
-_client = None
-if GEMINI_API_KEY and genai is not None:
+
+@functools.lru_cache(maxsize=None)
+def _gemini_client():
+    # One client per process, so its HTTP transport (and open connections)
+    # is shared by every request.
+    if not GEMINI_API_KEY:
+        return None
     try:
-        _client = genai.Client(api_key=GEMINI_API_KEY)
+        from google import genai
+        return genai.Client(api_key=GEMINI_API_KEY)
     except Exception:
-        _client = None
+        return None
 
 
 # --- positional OCR fixes -----------------------------------------------------
@@ -77,24 +116,47 @@ _LETTER_FIX = {
 }
 
 
+# str.translate tables for the two position classes of a PIN
+_DIGIT_TRANS = str.maketrans(_DIGIT_FIX)
+_LETTER_TRANS = str.maketrans(_LETTER_FIX)
+
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+_TOKENISH_RE = re.compile(r"[A-Z0-9]{7,12}")
+
+
 def _normalize_token(token: str) -> str:
-    return re.sub(r"[^A-Z0-9]", "", (token or "").upper())
+    return _NON_ALNUM_RE.sub("", (token or "").upper())
 
 
 def _fix_by_position(token8: str) -> str:
     """Apply simple OCR corrections based on known PIN positions."""
-    s = list(token8)
-    # digit positions: 0,1,3,4,5,6
-    for i in (0, 1, 3, 4, 5, 6):
-        s[i] = _DIGIT_FIX.get(s[i], s[i])
-    # letter positions: 2 (month), 7 (country)
-    for i in (2, 7):
-        s[i] = _LETTER_FIX.get(s[i], s[i])
-    return "".join(s)
+    # digit positions: 0,1,3,4,5,6 / letter positions: 2 (month), 7 (country)
+    return (
+        token8[0:2].translate(_DIGIT_TRANS)
+        + token8[2].translate(_LETTER_TRANS)
+        + token8[3:7].translate(_DIGIT_TRANS)
+        + token8[7].translate(_LETTER_TRANS)
+    )
+
+
+_DIGITS = frozenset("0123456789")
+_MONTHS = frozenset("ABCDEFGHIJKL")
+_COUNTRIES = frozenset("ESWNO")
 
 
 def _validate_strict(pin: str) -> bool:
-    return bool(STRICT_NMC_RE.fullmatch(pin))
+    """Fixed 8-position check of YY M #### C (same grammar as STRICT_NMC_RE)."""
+    return (
+        len(pin) == 8
+        and pin[0] in _DIGITS
+        and pin[1] in _DIGITS
+        and pin[2].upper() in _MONTHS
+        and pin[3] in _DIGITS
+        and pin[4] in _DIGITS
+        and pin[5] in _DIGITS
+        and pin[6] in _DIGITS
+        and pin[7].upper() in _COUNTRIES
+    )
 
 
 def _clean_and_validate(raw: str) -> Optional[str]:
@@ -136,31 +198,18 @@ def _clean_and_validate(raw: str) -> Optional[str]:
 
 # --- PDF/text helpers ---------------------------------------------------------
 
-def _read_pdf_text(path: Path, max_pages: int = 3) -> str:
-    try:
-        with pdfplumber.open(str(path)) as pdf:
-            parts = []
-            for page in pdf.pages[:max_pages]:
-                t = page.extract_text() or ""
-                if t:
-                    parts.append(t)
-            return "\n".join(parts)
-    except Exception:
-        return ""
-
-
-def _pdf_to_images(path: Path, max_pages: int = 2) -> List[Tuple[bytes, str]]:
-    out: List[Tuple[bytes, str]] = []
-    try:
-        doc = fitz.open(str(path))
-        for i in range(min(max_pages, doc.page_count)):
+def _pdf_to_images(doc: "fitz.Document", max_pages: int = 2, frac: float = 1.0) -> Iterator[Tuple[bytes, str]]:
+    """Render pages one at a time as small grayscale JPEGs (the top frac of each page)."""
+    fitz = _fitz()
+    for i in range(min(max_pages, doc.page_count)):
+        try:
             page = doc.load_page(i)
-            pix = page.get_pixmap(dpi=200)
-            out.append((pix.tobytes("png"), "image/png"))
-        doc.close()
-    except Exception:
-        pass
-    return out
+            r = page.rect
+            clip = fitz.Rect(r.x0, r.y0, r.x1, r.y0 + r.height * frac)
+            pix = page.get_pixmap(dpi=NMC_PDF_IMAGE_DPI, colorspace=fitz.csGRAY, clip=clip)
+            yield pix.tobytes("jpeg", jpg_quality=70), "image/jpeg"
+        except Exception:
+            return
 
 
 def _file_to_image(path: Path) -> Optional[Tuple[bytes, str]]:
@@ -185,62 +234,100 @@ def _extract_from_text(text: str) -> Tuple[Optional[str], float]:
     """
     Try anchor-first extraction from text, then global scan.
     Returns (pin, confidence).
+
+    The PIN label is nearly always in the page header, so the first
+    NMC_MAX_SCAN_CHARS are scanned on their own first. A label-anchored hit
+    there is final; anything weaker falls through to the full text.
     """
     if not text:
         return None, 0.0
 
-    T = text.upper()
+    if 0 < NMC_MAX_SCAN_CHARS < len(text):
+        pin, conf = _scan_text(text[:NMC_MAX_SCAN_CHARS].upper(), truncated=True)
+        if pin and conf >= 0.96:
+            return pin, conf
+
+    return _scan_text(text.upper())
+
+
+def _scan_text(T: str, truncated: bool = False) -> Tuple[Optional[str], float]:
+
+    anchors: List[int] = []  # end offsets of label matches
+    stricts: List[Tuple[int, str]] = []
+    looses: List[Tuple[int, str]] = []
+    for m in FUSED_RE.finditer(T):
+        kind = m.lastgroup
+        if kind == "anchor":
+            anchors.append(m.end())
+        elif kind == "strict":
+            stricts.append((m.start(), m.group(0)))
+        else:
+            looses.append((m.start(), m.group(0)))
+
+    # 1) Anchor-first: look near labels and parse the next ~120 chars
+    for a in anchors:
+        if truncated and a + _ANCHOR_WINDOW > len(T):
+            break  # window cut off by the slice; leave it to the full scan
+        limit = a + _ANCHOR_WINDOW - 8
+        # A PIN glued to its label ("PIN12A3456S") has no word boundary in T
+        head = T[a: a + 9]
+        glued_strict = STRICT_NMC_RE.match(head)
+        glued_loose = LOOSE_8_RE.match(head)
 
-    # 1) Anchor-first: look near labels and parse next ~80 chars
-    for m in ANCHOR_RE.finditer(T):
-        window = T[m.end(): m.end() + 120]
         # Try strict directly in the window
-        m_strict = STRICT_NMC_RE.search(window)
-        if m_strict:
-            return m_strict.group(0).upper(), 0.99
+        if glued_strict:
+            return glued_strict.group(0), 0.99
+        for start, tok in stricts:
+            if a <= start <= limit:
+                return tok, 0.99
 
         # Try loose candidate then clean/validate
-        m_loose = LOOSE_8_RE.search(window)
-        if m_loose:
-            pin = _clean_and_validate(m_loose.group(0))
+        first_loose = glued_loose.group(0) if glued_loose else None
+        if first_loose is None:
+            for start, tok in looses:
+                if a <= start <= limit:
+                    first_loose = tok
+                    break
+        if first_loose:
+            pin = _clean_and_validate(first_loose)
             if pin:
                 return pin, 0.98
 
         # As last resort, pick first token-like chunk and clean
-        tokenish = re.findall(r"[A-Z0-9]{7,12}", window)
+        window = T[a: a + _ANCHOR_WINDOW]
+        tokenish = _TOKENISH_RE.findall(window)
         for tok in tokenish[:3]:
             pin = _clean_and_validate(tok)
             if pin:
                 return pin, 0.96
 
     # 2) Global strict search
-    m2 = STRICT_NMC_RE.search(T)
-    if m2:
-        return m2.group(0).upper(), 0.95
-
-    # 3) Global loose search + validate
-    candidates = LOOSE_8_RE.findall(T)
-    if candidates:
-        # Prefer candidates with "NMC" nearby
-        for cand in candidates:
-            idx = T.find(cand.upper())
-            if idx != -1:
-                vicinity = T[max(0, idx - 80): idx + 80]
-                if "NMC" in vicinity:
-                    pin = _clean_and_validate(cand)
-                    if pin:
-                        return pin, 0.92
-        # Otherwise first valid
-        for cand in candidates:
-            pin = _clean_and_validate(cand)
-            if pin:
-                return pin, 0.88
+    if stricts:
+        return stricts[0][1], 0.95
+
+    # 3) Global loose search + validate: prefer candidates with "NMC" nearby,
+    # otherwise the first valid one
+    first_valid = None
+    for idx, cand in looses:
+        pin = _clean_and_validate(cand)
+        if not pin:
+            continue
+        if "NMC" in T[max(0, idx - 80): idx + 80]:
+            return pin, 0.92
+        if first_valid is None:
+            first_valid = pin
+    if first_valid:
+        return first_valid, 0.88
 
     return None, 0.0
 
 
-def _gemini_extract(images: List[Tuple[bytes, str]]) -> Tuple[Optional[str], float]:
-    if _client is None or types is None or not images:
+async def _gemini_extract(images: List[Tuple[bytes, str]]) -> Tuple[Optional[str], float]:
+    if not images:
+        return None, 0.0
+    client = _gemini_client()
+    types = _genai_types()
+    if client is None or types is None:
         return None, 0.0
 
     prompt = (
@@ -254,78 +341,214 @@ def _gemini_extract(images: List[Tuple[bytes, str]]) -> Tuple[Optional[str], flo
         "Example: 12A3456S"
     )
 
-    def _call(model: str) -> str:
-        parts = [types.Part.from_text(text=prompt)]
-        for b, mime in images:
-            parts.append(types.Part.from_bytes(data=b, mime_type=mime))
-        resp = _client.models.generate_content(
-            model=model,
-            contents=[types.Content(role="user", parts=parts)],
+    # Built once and shared by both model calls
+    parts = [types.Part.from_text(text=prompt)]
+    for b, mime in images:
+        parts.append(types.Part.from_bytes(data=b, mime_type=mime))
+    contents = [types.Content(role="user", parts=parts)]
+
+    async def _call(model: str) -> str:
+        resp = await asyncio.wait_for(
+            client.aio.models.generate_content(model=model, contents=contents),
+            timeout=GEMINI_TIMEOUT,
         )
         return (getattr(resp, "text", None) or "").strip()
 
-    for model in (GEMINI_MODEL_FAST, GEMINI_MODEL_STRONG):
-        try:
-            txt = _call(model)
-            pin = _clean_and_validate(txt)
-            if pin:
-                return pin, 0.90 if model == GEMINI_MODEL_FAST else 0.93
-        except Exception:
-            continue
+    # Race both models; first valid PIN wins and the other call is cancelled.
+    tasks = {
+        asyncio.create_task(_call(model)): (0.90 if model == GEMINI_MODEL_FAST else 0.93)
+        for model in dict.fromkeys((GEMINI_MODEL_FAST, GEMINI_MODEL_STRONG))
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                try:
+                    pin = _clean_and_validate(t.result())
+                except Exception:
+                    continue
+                if pin:
+                    return pin, tasks[t]
+    finally:
+        for t in pending:
+            t.cancel()
     return None, 0.0
 
 
-def extract_nmc_pin(file_path: Path) -> Dict[str, Any]:
+def _open_pdf(path: Path) -> Optional["fitz.Document"]:
+    try:
+        return _fitz().open(str(path))
+    except Exception:
+        return None
+
+
+def _pdf_text_pin(doc: "fitz.Document") -> Tuple[Optional[str], float]:
+    """
+    Text pass over the first pages (page-by-page, stops early).
+
+    Each page is scanned once. Whatever a page misses on its own can only be
+    a label near the end of one page whose value sits at the top of the
+    next, so only that seam is rescanned rather than the joined text.
+    """
+    n_pages = min(max(1, NMC_PDF_TEXT_PAGES), doc.page_count)
+    had_text = False
+    prev_tail = ""
+    try:
+        for i in range(n_pages):
+            t = doc.load_page(i).get_text("text") or ""
+            if not t:
+                continue
+            had_text = True
+
+            pin, conf = _extract_from_text(t)
+            if pin:
+                return pin, conf
+
+            if prev_tail:
+                pin, conf = _extract_from_text(prev_tail + "\n" + t[:_SEAM_CHARS])
+                if pin:
+                    return pin, conf
+            prev_tail = t[-_SEAM_CHARS:]
+    except Exception:
+        pass
+
+    if not had_text:
+        return None, 0.0
+
+    # Layout fallback for born-digital PDFs: content-stream order can split a
+    # label from its value, so retry once in reading order (top-left first).
+    try:
+        sorted_text = "\n".join(doc.load_page(i).get_text("text", sort=True) or "" for i in range(n_pages))
+    except Exception:
+        return None, 0.0
+    return _extract_from_text(sorted_text)
+
+
+def _read_text(path: Path) -> str:
+    try:
+        return path.read_text(errors="ignore")
+    except Exception:
+        return ""
+
+
+# --- result cache -------------------------------------------------------------
+
+# content digest -> successful extraction result (LRU, bounded)
+_extract_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# content digest -> extraction currently running for it; identical uploads
+# arriving meanwhile await this instead of starting their own Gemini calls
+_inflight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+
+
+def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {**result, "confidence": dict(result["confidence"])}
+
+
+def _file_digest(path: Path) -> Optional[str]:
+    """Content hash of the upload (suffix included, since it picks the strategy)."""
+    try:
+        h = hashlib.blake2b(digest_size=16)
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except Exception:
+        return None
+    return f"{path.suffix.lower()}:{h.hexdigest()}"
+
+
+async def extract_nmc_pin(file_path: Path) -> Dict[str, Any]:
     """
     Best-effort extraction.
 
+    Blocking work (hashing, PDF parse/render, file reads) runs in worker
+    threads and Gemini is called through the async client, so the event loop
+    stays free while an upload is processed.
+
+    Identical uploads are answered from an in-process cache. Only successful
+    results are cached, so a retry after a failed Gemini call runs again.
+    Concurrent identical uploads share a single extraction.
+
     Returns:
       { ok: bool, nmc_pin: str|None, confidence: { nmc_pin: float } }
     """
     path = Path(file_path)
 
+    key = await asyncio.to_thread(_file_digest, path)
+    if key is None:
+        return await _extract_nmc_pin_uncached(path)
+
+    if key in _extract_cache:
+        _extract_cache.move_to_end(key)
+        return _copy_result(_extract_cache[key])
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        shared = await asyncio.shield(pending)
+        if shared is not None:
+            return _copy_result(shared)
+        # the leader failed unexpectedly; run our own extraction
+        return await _extract_nmc_pin_uncached(path)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    result = None
+    try:
+        result = await _extract_nmc_pin_uncached(path)
+    finally:
+        _inflight.pop(key, None)
+        fut.set_result(result)
+
+    if result.get("ok") and NMC_EXTRACT_CACHE_SIZE > 0:
+        _extract_cache[key] = result
+        while len(_extract_cache) > NMC_EXTRACT_CACHE_SIZE:
+            _extract_cache.popitem(last=False)
+    return _copy_result(result)
+
+
+async def _extract_nmc_pin_uncached(path: Path) -> Dict[str, Any]:
+
     # PDF
     if path.suffix.lower() == ".pdf":
-        # 1) Text extraction (page-by-page, stops early)
-        try:
-            with pdfplumber.open(str(path)) as pdf:
-                combined_parts = []
-                for page in pdf.pages[:max(1, NMC_PDF_TEXT_PAGES)]:
-                    t = page.extract_text() or ""
-                    if t:
-                        # Try on this page first (helps when PIN is later in the PDF)
-                        pin_page, conf_page = _extract_from_text(t)
-                        if pin_page:
-                            return {"ok": True, "nmc_pin": pin_page, "confidence": {"nmc_pin": conf_page}}
-                        combined_parts.append(t)
-                text = "\n".join(combined_parts)
-        except Exception:
-            text = ""
-
-        pin, conf = _extract_from_text(text)
-        if pin:
-            return {"ok": True, "nmc_pin": pin, "confidence": {"nmc_pin": conf}}
+        # One fitz.Document serves both the text pass and the render pass.
+        doc = await asyncio.to_thread(_open_pdf, path)
+        if doc is None:
+            return {"ok": False, "nmc_pin": None, "confidence": {"nmc_pin": 0.0}}
 
-        # 2) Vision extraction (render first N pages as images)
-        imgs = _pdf_to_images(path, max_pages=max(1, NMC_PDF_IMAGE_PAGES))
-        pin2, conf2 = _gemini_extract(imgs)
-        if pin2:
-            return {"ok": True, "nmc_pin": pin2, "confidence": {"nmc_pin": conf2}}
+        try:
+            # 1) Text extraction
+            pin, conf = await asyncio.to_thread(_pdf_text_pin, doc)
+            if pin:
+                return {"ok": True, "nmc_pin": pin, "confidence": {"nmc_pin": conf}}
+
+            # 2) Vision extraction, one rendered page at a time
+            if _gemini_client() is None:
+                return {"ok": False, "nmc_pin": None, "confidence": {"nmc_pin": 0.0}}
+            fracs = [NMC_PDF_IMAGE_CLIP] if NMC_PDF_IMAGE_CLIP >= 1.0 else [NMC_PDF_IMAGE_CLIP, 1.0]
+            for frac in fracs:
+                pages = _pdf_to_images(doc, max_pages=max(1, NMC_PDF_IMAGE_PAGES), frac=frac)
+                while True:
+                    img = await asyncio.to_thread(next, pages, None)
+                    if img is None:
+                        break
+                    pin2, conf2 = await _gemini_extract([img])
+                    if pin2:
+                        return {"ok": True, "nmc_pin": pin2, "confidence": {"nmc_pin": conf2}}
+        finally:
+            doc.close()
 
         return {"ok": False, "nmc_pin": None, "confidence": {"nmc_pin": 0.0}}
 
     # Images
-    img = _file_to_image(path)
+    img = await asyncio.to_thread(_file_to_image, path)
     if img:
-        pin3, conf3 = _gemini_extract([img])
+        pin3, conf3 = await _gemini_extract([img])
         if pin3:
             return {"ok": True, "nmc_pin": pin3, "confidence": {"nmc_pin": conf3}}
         return {"ok": False, "nmc_pin": None, "confidence": {"nmc_pin": 0.0}}
 
     # Other types: text scan
-    try:
-        text = path.read_text(errors="ignore")
-    except Exception:
-        text = ""
+    text = await asyncio.to_thread(_read_text, path)
     pin4, conf4 = _extract_from_text(text)
     return {"ok": bool(pin4), "nmc_pin": pin4, "confidence": {"nmc_pin": conf4}}
@@ -10,19 +10,38 @@ Fix:
 Signature:
 - async def run_nmc_check_and_download_pdf(nmc_pin: str, out_dir: str)
 
+Browsers:
+- Chromium instances are kept warm in a small module-level pool (_BrowserPool);
+  every check runs in its own BrowserContext, closed afterwards. With
+  NMC_REUSE_CONTEXTS=1 contexts are instead parked with their browser and reset
+  between checks (pages closed, cookies cleared, consent re-added).
+- With NMC_CDP_URL set, the pool connects to an external Chromium over CDP
+  instead of launching its own.
+- The Playwright driver process is started once (warm_up_browsers() at app startup)
+  and lives until shutdown_browsers().
+
 Success:
 - Downloads and saves as "<Full Name> nmc check.pdf"
 
 Failure:
-- Returns a VISUAL snapshot PDF (screenshots stitched) containing URL + stage + error.
+- Returns a VISUAL snapshot PDF (screenshot of the failing page) containing URL + stage + error
+  and the trail of steps reached.
 """
 
 from __future__ import annotations
 
+import asyncio
+import io
+import json
+import os
 import re
+import tempfile
 import time
+from collections import deque
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urljoin
 
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
@@ -31,14 +50,215 @@ from pdf_utils import make_simple_error_pdf
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
+from PIL import Image  # reportlab already depends on Pillow
 
 NMC_URL = "https://www.nmc.org.uk/registration/search-the-register/"
 
+NMC_BROWSER_POOL_SIZE = int(os.getenv("NMC_BROWSER_POOL_SIZE", "3"))
+NMC_BROWSER_IDLE_TIMEOUT = float(os.getenv("NMC_BROWSER_IDLE_TIMEOUT", "300"))
+# e.g. http://chromium:9222 — connect to an already running Chromium instead of launching one.
+NMC_CDP_URL = os.getenv("NMC_CDP_URL", "").strip()
+# Park a check's context with its browser and reset it for the next check instead
+# of closing it and creating a new one. Off by default: the reset only clears
+# cookies, so localStorage, sessionStorage, IndexedDB, service workers and
+# permissions carry over from one PIN's check to the next.
+NMC_REUSE_CONTEXTS = os.getenv("NMC_REUSE_CONTEXTS", "").strip().lower() in ("1", "true", "yes", "on")
+# Upper bound on register pages open at once, across concurrent checks.
+NMC_MAX_CONCURRENCY = max(1, int(os.getenv("NMC_MAX_CONCURRENCY", "4")))
+
+# Cookiebot consent cookies are persisted here and pre-loaded into new contexts.
+NMC_CONSENT_STATE_PATH = Path(
+    os.getenv("NMC_CONSENT_STATE_PATH") or os.path.join(tempfile.gettempdir(), "nmc_consent_state.json")
+)
+NMC_CONSENT_STATE_MAX_AGE = float(os.getenv("NMC_CONSENT_STATE_MAX_AGE", str(30 * 86400)))
+
+# Playwright already passes --disable-extensions, --disable-background-networking,
+# --disable-default-apps, --disable-sync, --no-first-run, --mute-audio and its own
+# --disable-features list (a second --disable-features here would replace it).
+_LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-blink-features=AutomationControlled",
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+]
+
+_CONTEXT_OPTIONS = dict(
+    accept_downloads=True,
+    viewport={"width": 1365, "height": 768},
+    user_agent=(
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/122.0.0.0 Safari/537.36"
+    ),
+)
+
+_PDF_HEADERS = {"Accept": "application/pdf"}
+
+
+def _is_pdf_response(resp) -> bool:
+    return "application/pdf" in (resp.headers.get("content-type") or "").lower()
+
+
+def _is_inline_pdf_response(resp) -> bool:
+    # Attachments surface as a download event, and their body isn't readable here
+    return _is_pdf_response(resp) and "attachment" not in (resp.headers.get("content-disposition") or "").lower()
+
+# Sub-resources the flow never needs. Stylesheets stay (visibility checks and
+# the failure screenshot depend on layout) and so does Cookiebot (it gates
+# the PIN input). NMC_BLOCK_RESOURCES=0 turns the filter off, e.g. to get
+# screenshots with images while debugging.
+NMC_BLOCK_RESOURCES = os.getenv("NMC_BLOCK_RESOURCES", "1").strip().lower() not in ("0", "false", "no", "off")
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font"})
+_BLOCKED_HOSTS = ("googletagmanager.", "google-analytics.", "doubleclick.", "hotjar.", "facebook.net")
+
+
+async def _route_filter(route) -> None:
+    req = route.request
+    if req.resource_type in _BLOCKED_RESOURCE_TYPES or any(h in req.url for h in _BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class _BrowserPool:
+    """Warm headless Chromium instances shared across checks.
+
+    - The Playwright driver is started once, on first use.
+    - Up to max_instances browsers are kept; acquire() hands out an idle one,
+      launches a new one below the cap, or waits for a release.
+    - Browsers idle for longer than idle_timeout are closed by a reaper task.
+    - A released browser may park one spare BrowserContext with it; the next
+      holder takes it with take_spare() and resets it before use.
+    """
+
+    def __init__(self, max_instances: int, idle_timeout: float) -> None:
+        self.max_instances = max(1, max_instances)
+        self.idle_timeout = idle_timeout
+        self._pw = None
+        self._idle: List[Tuple[object, float]] = []  # (browser, released_at)
+        self._busy: Set[object] = set()
+        self._spares: Dict[object, object] = {}  # browser -> parked context
+        self._launching = 0
+        self._cond = asyncio.Condition()
+        self._start_lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                while self._idle:
+                    browser, _ = self._idle.pop()
+                    if browser.is_connected():
+                        self._busy.add(browser)
+                        return browser
+                    self._spares.pop(browser, None)
+                if len(self._busy) + self._launching < self.max_instances:
+                    self._launching += 1
+                    break
+                await self._cond.wait()
+
+        try:
+            browser = await self._launch()
+        except BaseException:
+            async with self._cond:
+                self._launching -= 1
+                self._cond.notify()
+            raise
+
+        async with self._cond:
+            self._launching -= 1
+            self._busy.add(browser)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+        return browser
+
+    async def release(self, browser, spare=None) -> None:
+        async with self._cond:
+            self._busy.discard(browser)
+            if browser.is_connected():
+                if spare is not None:
+                    self._spares[browser] = spare
+                self._idle.append((browser, time.monotonic()))
+            else:
+                self._spares.pop(browser, None)
+            self._cond.notify()
+
+    def take_spare(self, browser):
+        """Context parked with `browser` by the previous holder, if any."""
+        return self._spares.pop(browser, None)
+
+    async def close(self) -> None:
+        """Close every pooled browser and stop the driver (app shutdown)."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._cond:
+            browsers = [b for b, _ in self._idle] + list(self._busy)
+            self._idle = []
+            self._busy.clear()
+            self._spares.clear()
+        for b in browsers:
+            try:
+                await b.close()
+            except Exception:
+                pass
+        async with self._start_lock:
+            if self._pw is not None:
+                try:
+                    await self._pw.stop()
+                except Exception:
+                    pass
+                self._pw = None
+
+    async def _launch(self):
+        async with self._start_lock:
+            if self._pw is None:
+                self._pw = await async_playwright().start()
+        if NMC_CDP_URL:
+            # Long-lived Chromium run elsewhere (sidecar); "closing" only disconnects
+            return await self._pw.chromium.connect_over_cdp(NMC_CDP_URL)
+        return await self._pw.chromium.launch(headless=True, args=_LAUNCH_ARGS)
+
+    async def _reap(self) -> None:
+        while True:
+            await asyncio.sleep(max(5.0, self.idle_timeout / 4))
+            now = time.monotonic()
+            async with self._cond:
+                stale = [b for b, t in self._idle if now - t >= self.idle_timeout]
+                self._idle = [(b, t) for b, t in self._idle if now - t < self.idle_timeout]
+                for b in stale:
+                    self._spares.pop(b, None)
+                empty = not self._idle and not self._busy and not self._launching
+            for b in stale:
+                try:
+                    await b.close()
+                except Exception:
+                    pass
+            if empty:
+                return
+
+
+_POOL = _BrowserPool(NMC_BROWSER_POOL_SIZE, NMC_BROWSER_IDLE_TIMEOUT)
+
+
+async def warm_up_browsers() -> None:
+    """Start the driver and one browser ahead of the first check."""
+    await _POOL.release(await _POOL.acquire())
+
+
+async def shutdown_browsers() -> None:
+    """Release the pooled browsers and the Playwright driver process."""
+    if _TEARDOWNS:
+        await asyncio.gather(*list(_TEARDOWNS), return_exceptions=True)
+    await _POOL.close()
+
+
+_FILENAME_DROP = str.maketrans("", "", '\\/:*?"<>|')
+
 
 def _sanitize_filename(s: str) -> str:
-    s = (s or "").strip()
-    s = re.sub(r"\s+", " ", s)
-    s = re.sub(r'[\\/:*?"<>|]', "", s)
+    s = " ".join((s or "").split()).translate(_FILENAME_DROP)
     return (s[:120].strip() or "NMC")
 
 
@@ -57,12 +277,39 @@ def _wrap(text: str, width: int) -> List[str]:
     return lines or [""]
 
 
-def _make_snapshot_pdf(out_path: Path, *, url: str, stage: str, notes: List[str], image_paths: List[Path]) -> None:
-    out_path = Path(out_path)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+SNAPSHOT_IMAGE_DPI = 150
+# Failure screenshots are kept for debugging only with NMC_KEEP_SHOTS=1, in
+# NMC_SHOTS_DIR: out_dir is the per-request job directory, which the app deletes
+# as soon as the response has been sent.
+NMC_KEEP_SHOTS = os.getenv("NMC_KEEP_SHOTS", "").strip().lower() in ("1", "true", "yes", "on")
+NMC_SHOTS_DIR = Path(os.getenv("NMC_SHOTS_DIR") or (Path(__file__).resolve().parent / "data" / "shots"))
+
+# Snapshot page geometry (points)
+_PAGE_W, _PAGE_H = A4
+_IMG_MARGIN = 36
+_IMG_MAX_W = _PAGE_W - 2 * _IMG_MARGIN
+_IMG_MAX_H = _PAGE_H - 2 * _IMG_MARGIN
+
+
+def _downscaled_jpeg(src: Union[str, io.BytesIO], size: Tuple[int, int]) -> ImageReader:
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        im.thumbnail(size, Image.BILINEAR)
+        buf = io.BytesIO()
+        im.save(buf, "JPEG", quality=70)
+    buf.seek(0)
+    return ImageReader(buf)
 
+
+def _make_snapshot_pdf(
+    out_path: Path, *, url: str, stage: str, notes: List[str], images: List[Union[Path, bytes]]
+) -> None:
+    """Cover page with stage/URL/notes, then one page per image (a path or raw bytes).
+
+    The caller has already created out_path's directory.
+    """
     c = canvas.Canvas(str(out_path), pagesize=A4)
-    w, h = A4
+    w, h = _PAGE_W, _PAGE_H
 
     # Cover page
     y = h - 72
@@ -87,34 +334,216 @@ def _make_snapshot_pdf(out_path: Path, *, url: str, stage: str, notes: List[str]
 
     c.showPage()
 
-    # Images
-    for p in image_paths:
+    # Images. JPEGs are handed to reportlab without a mask, which embeds the bytes
+    # verbatim (DCTDecode) instead of decoding and re-compressing.
+    for item in images:
+        if isinstance(item, bytes):
+            src = io.BytesIO(item)
+            is_jpeg = item[:2] == b"\xff\xd8"
+        else:
+            src = str(item)
+            is_jpeg = Path(src).suffix.lower() in (".jpg", ".jpeg")
         try:
-            img = ImageReader(str(p))
+            reader = ImageReader(src)
+            iw, ih = reader.getSize()
         except Exception:
             continue
-        iw, ih = img.getSize()
-        margin = 36
-        max_w = w - 2 * margin
-        max_h = h - 2 * margin
-        scale = min(max_w / iw, max_h / ih)
+        scale = min(_IMG_MAX_W / iw, _IMG_MAX_H / ih)
         draw_w = iw * scale
         draw_h = ih * scale
         x = (w - draw_w) / 2
         y = (h - draw_h) / 2
-        c.drawImage(img, x, y, width=draw_w, height=draw_h, preserveAspectRatio=True, mask="auto")
+
+        # Pixels beyond ~SNAPSHOT_IMAGE_DPI at the drawn size are invisible on the
+        # page but still stored; shrink those images before embedding.
+        img = reader if isinstance(item, bytes) else src
+        px_w = int(draw_w * SNAPSHOT_IMAGE_DPI / 72)
+        if iw > px_w * 1.25:
+            try:
+                orig = io.BytesIO(item) if isinstance(item, bytes) else src
+                img = _downscaled_jpeg(orig, (px_w, int(draw_h * SNAPSHOT_IMAGE_DPI / 72)))
+                is_jpeg = True
+            except Exception:
+                pass
+        c.drawImage(
+            img, x, y, width=draw_w, height=draw_h, preserveAspectRatio=True,
+            mask=None if is_jpeg else "auto",
+        )
         c.showPage()
 
     c.save()
 
 
-async def _save_shot(page, out_dir: Path, prefix: str, shots: List[Path]) -> None:
-    p = out_dir / f"{prefix}_{int(time.time())}.png"
-    await page.screenshot(path=str(p), full_page=True)
-    shots.append(p)
+# Cookiebot accept buttons in priority order: the explicit "allow all" IDs
+# first, then case-insensitive text fallbacks matched against buttons,
+# role=button elements and submit/button inputs. _COOKIE_CLICK_JS walks
+# both lists inside the frame and clicks the first visible match, so each
+# frame costs one round-trip.
+_COOKIE_BUTTON_IDS = [
+    # Cookiebot common IDs (varies by site/config)
+    "CybotCookiebotDialogBodyLevelButtonLevelOptinAllowAll",
+    "CybotCookiebotDialogBodyButtonAccept",
+    "CybotCookiebotDialogBodyButtonAcceptAll",
+    "CybotCookiebotDialogBodyLevelButtonAccept",
+]
+_COOKIE_BUTTON_TEXTS = [
+    "i agree to all cookies",
+    "agree to all cookies",
+    "allow all",
+    "accept all",
+    "accept",
+]
+
+_COOKIE_CLICK_FN = """(ids, texts, root) => {
+    const shown = el => el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    for (const id of ids) {
+        const el = document.getElementById(id);
+        if (shown(el)) { el.click(); return id; }
+    }
+    // One DOM pass collects every button-like element with its label
+    const buttons = Array.from(
+        (root || document).querySelectorAll("button, [role='button'], input[type='button'], input[type='submit']")
+    ).filter(shown).map(el => [el, (el.textContent || el.value || '').trim().toLowerCase()]);
+    for (const t of texts) {
+        const hit = buttons.find(([, label]) => label.includes(t));
+        if (hit) { hit[0].click(); return t; }
+    }
+    return null;
+}"""
+
+_COOKIE_CLICK_JS = "([ids, texts]) => (" + _COOKIE_CLICK_FN + ")(ids, texts, null)"
+
+# Installed on every context: a MutationObserver clicks the consent button the
+# moment Cookiebot renders it, so the cookie step usually finds the PIN already
+# unlocked. Text fallbacks are only matched inside the Cookiebot dialog here,
+# and the observer gives up after 15s.
+_COOKIE_AUTO_ACCEPT_JS = """(() => {
+    const click = (""" + _COOKIE_CLICK_FN + """);
+    const ids = """ + json.dumps(_COOKIE_BUTTON_IDS) + """;
+    const texts = """ + json.dumps(_COOKIE_BUTTON_TEXTS) + """;
+    const attempt = () => {
+        const dialog = document.getElementById('CybotCookiebotDialog');
+        return click(ids, dialog ? texts : [], dialog);
+    };
+    const start = () => {
+        if (attempt()) return;
+        const obs = new MutationObserver(() => { if (attempt()) obs.disconnect(); });
+        obs.observe(document.documentElement, {subtree: true, childList: true, attributes: true, attributeFilter: ['style', 'class']});
+        setTimeout(() => obs.disconnect(), 15000);
+    };
+    if (document.documentElement) start();
+    else document.addEventListener('DOMContentLoaded', start);
+})();"""
+
+
+# Bot-challenge widgets (one selector union) and page-text cues. _BOT_CHECK_JS
+# tests both in the browser and returns only the matching cue, or null.
+_CAPTCHA_SEL = ", ".join([
+    "iframe[src*='captcha' i]",
+    "iframe[title*='captcha' i]",
+    "div.g-recaptcha",
+    "[data-sitekey]",
+    "iframe[src*='challenges.cloudflare.com' i]",
+    "div[class*='turnstile' i]",
+    "div[class*='hcaptcha' i]",
+])
+_BOT_TEXT_CUES = [
+    "verify you are human",
+    "are you a robot",
+    "unusual traffic",
+    "access denied",
+    "checking your browser",
+]
+_BOT_CHECK_JS = """([sel, cues]) => {
+    if (document.querySelector(sel)) return 'captcha widget';
+    const t = ((document.body && document.body.innerText) || '').toLowerCase();
+    return cues.find(c => t.includes(c)) || null;
+}"""
+
+
+_SET_VALUE_JS = """(el, v) => {
+    el.value = v;
+    el.dispatchEvent(new Event('input', {bubbles: true}));
+    el.dispatchEvent(new Event('change', {bubbles: true}));
+    return el.value;
+}"""
+
+
+_PIN_ENABLED_JS = """() => {
+    const pin = document.querySelector('#PinNumber');
+    return !!pin && !pin.hasAttribute('disabled') && !pin.classList.contains('cookies-only-disabled');
+}"""
+
+
+# Resolves to "enabled" once the PIN input is unlocked, "banner" once the
+# Cookiebot dialog is showing.
+_CONSENT_STATE_JS = """() => {
+    const pin = document.querySelector('#PinNumber');
+    if (pin && !pin.hasAttribute('disabled') && !pin.classList.contains('cookies-only-disabled')) return "enabled";
+    const d = document.getElementById('CybotCookiebotDialog');
+    if (d && d.getClientRects().length > 0) return "banner";
+    return false;
+}"""
+
+
+# Resolves to "none" on a no-match message, "ok" once results are listed.
+_RESULTS_STATE_JS = """() => {
+    const t = (document.body && document.body.innerText) || "";
+    if (/Your\\s+search\\s+returned\\s+(0|no)\\b|no\\s+results\\s+found/i.test(t)) return "none";
+    if (/Your\\s+search\\s+returned/i.test(t) || /View\\s+details/i.test(t)) return "ok";
+    return false;
+}"""
+
+
+class _StepLog:
+    """Trail of the steps a run reached: (time, label, url).
+
+    Nothing is captured on the way; a successful run never pays for
+    screenshots. On failure the trail goes into the snapshot PDF as text,
+    next to a single screenshot of the page as it was when the run failed.
+    """
+
+    def __init__(self, maxlen: int = 12) -> None:
+        self.steps: Deque[Tuple[str, str, str]] = deque(maxlen=maxlen)
+
+    def mark(self, page, label: str) -> None:
+        try:
+            url = page.url
+        except Exception:
+            url = ""
+        self.steps.append((time.strftime("%H:%M:%S"), label, url))
+
+    def lines(self) -> List[str]:
+        return [f"{t}  {label}  {url}" for t, label, url in self.steps]
+
 
+async def _failure_shot(page, out_dir: Path, notes: List[str]) -> List[bytes]:
+    """Viewport JPEG, kept in memory for the snapshot PDF.
 
-async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[Path]) -> None:
+    With NMC_KEEP_SHOTS=1 the JPEG and the page HTML are also written to
+    NMC_SHOTS_DIR for debugging, and their paths are listed in notes.
+    """
+    try:
+        shot = await page.screenshot(type="jpeg", quality=65)
+    except Exception:
+        shot = None
+    if NMC_KEEP_SHOTS:
+        stem = f"{out_dir.name}_{int(time.time())}"
+        try:
+            NMC_SHOTS_DIR.mkdir(parents=True, exist_ok=True)
+            html = NMC_SHOTS_DIR / f"{stem}.html"
+            html.write_text(await page.content(), encoding="utf-8")
+            notes.append(f"Page HTML kept: {html}")
+            if shot is not None:
+                kept = NMC_SHOTS_DIR / f"{stem}.jpg"
+                kept.write_bytes(shot)
+                notes.append(f"Screenshot kept: {kept}")
+        except Exception:
+            pass
+    return [shot] if shot is not None else []
+
+
+async def _accept_cookies_and_wait_enable_pin(page, steps: _StepLog) -> str:
     """Accept Cookiebot consent (if present) and wait until PIN input is enabled.
 
     Why we do so much here:
@@ -126,69 +555,61 @@ async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[P
         2) Call Cookiebot JS APIs if present
         3) Set common consent cookies then reload
         4) (Last resort) remove the blocking class + hide overlay so the flow can proceed
+
+    Returns which step unlocked the PIN: "ready" (already enabled on the first
+    check), "banner", "api", "cookies" or "forced". Only the first three mean
+    Cookiebot itself registered consent.
     """
-    await _save_shot(page, out_dir, "01_before_cookies", shots)
-
-    cookie_selectors = [
-        # Cookiebot common IDs (varies by site/config)
-        "#CybotCookiebotDialogBodyLevelButtonLevelOptinAllowAll",
-        "#CybotCookiebotDialogBodyButtonAccept",
-        "#CybotCookiebotDialogBodyButtonAcceptAll",
-        "#CybotCookiebotDialogBodyLevelButtonAccept",
-
-        # Text fallbacks
-        "button:has-text('I agree to all cookies')",
-        "button:has-text('Agree to all cookies')",
-        "button:has-text('Allow all')",
-        "button:has-text('Accept all')",
-        "button:has-text('Accept')",
-    ]
+    steps.mark(page, "01_before_cookies")
 
     async def try_click_in_context(ctx) -> bool:
-        for sel in cookie_selectors:
-            loc = ctx.locator(sel).first
-            try:
-                if await loc.is_visible(timeout=1200):
-                    await loc.click(timeout=8000, force=True)
-                    return True
-            except Exception:
-                continue
-        return False
+        try:
+            return bool(await ctx.evaluate(_COOKIE_CLICK_JS, [_COOKIE_BUTTON_IDS, _COOKIE_BUTTON_TEXTS]))
+        except Exception:
+            return False
 
     pin_loc = page.locator("#PinNumber").first
     await pin_loc.wait_for(state="visible", timeout=20000)
 
-    async def pin_enabled() -> bool:
-        cls = (await pin_loc.get_attribute("class")) or ""
-        dis = await pin_loc.get_attribute("disabled")
-        return (dis is None) and ("cookies-only-disabled" not in cls)
-
     async def wait_pin_enabled(ms_total: int) -> bool:
+        # Checked in the page on every animation frame; returns as soon as the gate lifts.
+        # A navigation mid-wait throws, so retry until the budget is spent.
         end = time.time() + (ms_total / 1000.0)
-        while time.time() < end:
+        while True:
+            left = int((end - time.time()) * 1000)
+            if left <= 0:
+                return False
             try:
-                if await pin_enabled():
-                    return True
+                await page.wait_for_function(_PIN_ENABLED_JS, timeout=left)
+                return True
+            except PlaywrightTimeoutError:
+                return False
             except Exception:
-                pass
-            await page.wait_for_timeout(350)
-        return False
+                await asyncio.sleep(0.1)
 
-    # 1) Try clicking banner buttons on page and in iframes
-    clicked = await try_click_in_context(page)
-    if not clicked:
-        for fr in page.frames:
-            try:
-                if await try_click_in_context(fr):
-                    clicked = True
-                    break
-            except Exception:
-                continue
+    # 1) Try clicking banner buttons on page and in iframes.
+    # Navigation only waits for commit, so give the banner a moment to render first;
+    # when consent is already in the context (cached state) the PIN unlocks instead.
+    try:
+        state = await (await page.wait_for_function(_CONSENT_STATE_JS, timeout=5000)).json_value()
+        if state == "enabled":
+            steps.mark(page, "02_consent_already_given")
+            return "ready"
+    except Exception:
+        pass
+    # The banner may live in the page or in an iframe; sweep every frame at once
+    # (page.frames includes the main frame).
+    clicked = any(await asyncio.gather(*(try_click_in_context(fr) for fr in page.frames)))
 
-    await page.wait_for_timeout(900)
-    await _save_shot(page, out_dir, "02_after_cookie_click", shots)
+    if clicked:
+        # The dialog closes once consent is registered; no need for a fixed pause
+        try:
+            await page.locator("#CybotCookiebotDialog").first.wait_for(state="hidden", timeout=3000)
+        except Exception:
+            pass
+    steps.mark(page, "02_after_cookie_click")
     if await wait_pin_enabled(8000):
-        return
+        return "banner"
 
     # 2) Try Cookiebot JS APIs (when available)
     try:
@@ -216,10 +637,9 @@ async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[P
     except Exception:
         pass
 
-    await page.wait_for_timeout(900)
-    await _save_shot(page, out_dir, "02c_after_cookiebot_js", shots)
+    steps.mark(page, "02c_after_cookiebot_js")
     if await wait_pin_enabled(6000):
-        return
+        return "api"
 
     # 3) Set common consent cookies then reload.
     try:
@@ -243,17 +663,17 @@ async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[P
     except Exception:
         pass
 
+    # Commit is enough; the PIN wait below is what actually gates the next step
     try:
-        await page.reload(wait_until="domcontentloaded", timeout=60000)
+        await page.reload(wait_until="commit", timeout=15000)
     except Exception:
-        await page.goto(page.url, wait_until="domcontentloaded", timeout=60000)
+        await page.goto(page.url, wait_until="commit", timeout=15000)
 
-    await page.wait_for_timeout(900)
-    await _save_shot(page, out_dir, "02d_after_cookie_cookies_reload", shots)
+    steps.mark(page, "02d_after_cookie_cookies_reload")
     pin_loc = page.locator("#PinNumber").first
     await pin_loc.wait_for(state="visible", timeout=20000)
     if await wait_pin_enabled(9000):
-        return
+        return "cookies"
 
     # 4) LAST RESORT: remove the client-side gate + overlay.
     try:
@@ -276,10 +696,9 @@ async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[P
     except Exception:
         pass
 
-    await page.wait_for_timeout(500)
-    await _save_shot(page, out_dir, "02e_after_force_enable", shots)
+    steps.mark(page, "02e_after_force_enable")
     if await wait_pin_enabled(3000):
-        return
+        return "forced"
 
     last_class = ""
     last_disabled = None
@@ -293,19 +712,188 @@ async def _accept_cookies_and_wait_enable_pin(page, out_dir: Path, shots: List[P
     )
 
 
+# Resolves to the visible details dialog's text (or the body's) once
+# "Practitioner Details" is on screen.
+_DETAILS_TEXT_JS = """() => {
+    const body = document.body;
+    if (!body || !/Practitioner\\s+Details/i.test(body.innerText)) return false;
+    const d = Array.from(document.querySelectorAll("div[role='dialog']")).find(el => el.getClientRects().length > 0);
+    return (d || body).innerText;
+}"""
+
+# Page text patterns, compiled once
+_NAME_RE = re.compile(r"\bName\b\s*[:\n]\s*([A-Za-z][A-Za-z .,'-]{1,80})")
+_NAME_BEFORE_GEO_RE = re.compile(r"\bName\b\s+([A-Za-z][A-Za-z .,'-]{1,80})\s+\bGeograph", re.I)
+_SEARCH_BTN_RE = re.compile(r"^Search$", re.I)
+_VIEW_DETAILS_RE = re.compile(r"View\s+details", re.I)
+_DOWNLOAD_PDF_RE = re.compile(r"Download\s+a\s+pdf", re.I)
+
+
 async def _extract_name_from_modal(page) -> str:
-    await page.get_by_text(re.compile(r"Practitioner\s+Details", re.I)).first.wait_for(timeout=20000)
+    # Waits for the details to render and returns the dialog's text (or the
+    # body's) from the same in-page check.
+    text = await (await page.wait_for_function(_DETAILS_TEXT_JS, timeout=20000)).json_value()
+
+    m = _NAME_RE.search(text)
+    if not m:
+        m = _NAME_BEFORE_GEO_RE.search(text)
+    return (m.group(1).strip() if m else "NMC")
+
+
+_TEARDOWNS: Set[asyncio.Task] = set()
+
+
+def _track(task: asyncio.Task) -> None:
+    _TEARDOWNS.add(task)
+    task.add_done_callback(_TEARDOWNS.discard)
+
+
+async def _close_quietly(obj) -> None:
+    try:
+        await obj.close()
+    except Exception:
+        pass
+
+
+async def _close_and_release(context, browser) -> None:
+    if context is not None and NMC_REUSE_CONTEXTS and browser.is_connected():
+        await _POOL.release(browser, spare=context)
+        return
+    if context is not None:
+        await _close_quietly(context)
+    await _POOL.release(browser)
+
+
+# Only the consent cookies are carried over; session and anti-forgery cookies
+# stay per context.
+_CONSENT_COOKIE_PREFIXES = ("CookieConsent", "Cookiebot")
+_consent_state: Optional[Tuple[float, dict]] = None  # (saved_at, storage_state)
+_consent_loaded = False
+
+
+def _cached_consent_state() -> Optional[dict]:
+    global _consent_state, _consent_loaded
+    if not _consent_loaded:
+        _consent_loaded = True
+        try:
+            saved_at = NMC_CONSENT_STATE_PATH.stat().st_mtime
+            _consent_state = (saved_at, json.loads(NMC_CONSENT_STATE_PATH.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            _consent_state = None
+    if _consent_state is None or time.time() - _consent_state[0] > NMC_CONSENT_STATE_MAX_AGE:
+        return None
+    return _consent_state[1]
 
-    dialog = page.locator("div[role='dialog']").first
+
+async def _remember_consent(context) -> None:
+    global _consent_state
     try:
-        text = await dialog.inner_text() if await dialog.is_visible(timeout=1500) else await page.inner_text("body")
+        state = await context.storage_state()
     except Exception:
-        text = await page.inner_text("body")
+        return
+    cookies = [c for c in state.get("cookies", []) if c.get("name", "").startswith(_CONSENT_COOKIE_PREFIXES)]
+    if not cookies:
+        return
+    _consent_state = (time.time(), {"cookies": cookies, "origins": []})
+    try:
+        NMC_CONSENT_STATE_PATH.write_text(json.dumps(_consent_state[1]), encoding="utf-8")
+    except OSError:
+        pass
 
-    m = re.search(r"\bName\b\s*[:\n]\s*([A-Za-z][A-Za-z .,'-]{1,80})", text)
-    if not m:
-        m = re.search(r"\bName\b\s+([A-Za-z][A-Za-z .,'-]{1,80})\s+\bGeograph", text, re.I)
-    return (m.group(1).strip() if m else "NMC")
+
+def _forget_consent() -> None:
+    """Drop the saved consent (memory and file) after it failed to unlock the PIN."""
+    global _consent_state, _consent_loaded
+    _consent_state = None
+    _consent_loaded = True
+    try:
+        NMC_CONSENT_STATE_PATH.unlink()
+    except OSError:
+        pass
+
+
+async def _has_consent_cookies(context) -> bool:
+    try:
+        cookies = await context.cookies(NMC_URL)
+    except Exception:
+        return False
+    return any(c.get("name", "").startswith(_CONSENT_COOKIE_PREFIXES) for c in cookies)
+
+
+async def _reset_context(context) -> None:
+    """Close a parked context's pages and replace its cookies with the consent cookies.
+
+    Origin storage (localStorage, IndexedDB, service workers) is not cleared.
+    """
+    for p in list(context.pages):
+        await _close_quietly(p)
+    await context.clear_cookies()
+    consent = _cached_consent_state()
+    if consent is not None:
+        await context.add_cookies(consent["cookies"])
+
+
+async def _new_context(browser):
+    spare = _POOL.take_spare(browser)
+    if spare is not None:
+        try:
+            await _reset_context(spare)
+            return spare
+        except Exception:
+            await _close_quietly(spare)
+
+    consent = _cached_consent_state()
+    if consent is not None:
+        context = await browser.new_context(storage_state=consent, **_CONTEXT_OPTIONS)
+    else:
+        context = await browser.new_context(**_CONTEXT_OPTIONS)
+    context.set_default_navigation_timeout(15000)
+    context.set_default_timeout(10000)
+    await context.add_init_script(_COOKIE_AUTO_ACCEPT_JS)
+    if NMC_BLOCK_RESOURCES:
+        # On the context, so popups share the same handler
+        await context.route("**/*", _route_filter)
+    return context
+
+
+def _missing_pin_result(out_dir_path: Path) -> dict:
+    out = out_dir_path / "NMC-Error-Missing-PIN.pdf"
+    make_simple_error_pdf(out, "NMC check failed", ["Missing NMC PIN."])
+    return {"ok": False, "pdf_path": str(out), "stage": "missing_pin"}
+
+
+def _failure_result(
+    out_dir_path: Path, *, stage: str, url: str, notes: List[str], shots: List[bytes], error: Exception
+) -> dict:
+    try:
+        snap = out_dir_path / f"NMC-Snapshot-{int(time.time())}.pdf"
+        _make_snapshot_pdf(snap, url=url, stage=stage, notes=notes, images=shots)
+        return {"ok": False, "pdf_path": str(snap), "stage": stage, "error": str(error), "url": url}
+    except Exception:
+        out = out_dir_path / f"NMC-Error-{int(time.time())}.pdf"
+        make_simple_error_pdf(out, "NMC check failed", [f"Stage: {stage}", str(error)])
+        return {"ok": False, "pdf_path": str(out), "stage": stage, "error": str(error), "url": url}
+
+
+def _schedule_teardown(context, browser) -> None:
+    # The result is already on disk; tear the context down after returning
+    _track(asyncio.create_task(_close_and_release(context, browser)))
+
+
+@asynccontextmanager
+async def _pooled_context() -> AsyncIterator[object]:
+    """Check out a pooled browser with a new context (or a reset one, see NMC_REUSE_CONTEXTS).
+
+    Teardown is scheduled on exit however the block ends, so an exception
+    between acquiring and closing can't leak the browser.
+    """
+    browser = await _POOL.acquire()
+    context = None
+    try:
+        context = await _new_context(browser)
+        yield context
+    finally:
+        _schedule_teardown(context, browser)
 
 
 async def run_nmc_check_and_download_pdf(nmc_pin: str, out_dir: str):
@@ -314,143 +902,245 @@ async def run_nmc_check_and_download_pdf(nmc_pin: str, out_dir: str):
 
     pin = (nmc_pin or "").strip().upper()
     if not pin:
-        out = out_dir_path / "NMC-Error-Missing-PIN.pdf"
-        make_simple_error_pdf(out, "NMC check failed", ["Missing NMC PIN."])
-        return {"ok": False, "pdf_path": str(out), "stage": "missing_pin"}
+        return _missing_pin_result(out_dir_path)
+
+    context = None
+    try:
+        # New context per check so nothing leaks between PINs (unless NMC_REUSE_CONTEXTS=1)
+        async with _pooled_context() as context:
+            return await _check_pin_in_context(context, pin, out_dir_path)
+    except Exception as e:
+        if context is not None:
+            raise
+        return _failure_result(
+            out_dir_path, stage="launch", url=NMC_URL,
+            notes=[f"Error: {type(e).__name__}: {e}"], shots=[], error=e,
+        )
+
 
+_PAGE_SLOTS = asyncio.Semaphore(NMC_MAX_CONCURRENCY)
+
+
+async def _check_pin_in_context(context, pin: str, out_dir_path: Path) -> dict:
+    """Run the register flow for one PIN in a new tab of an open context."""
+    async with _PAGE_SLOTS:
+        return await _check_pin_on_new_page(context, pin, out_dir_path)
+
+
+async def _check_pin_on_new_page(context, pin: str, out_dir_path: Path) -> dict:
     stage = "start"
-    shots: List[Path] = []
+    steps = _StepLog()
     notes: List[str] = []
     current_url = NMC_URL
 
+    page = None
     try:
-        async with async_playwright() as p:
-            stage = "launch"
-            browser = await p.chromium.launch(
-                headless=True,
-                args=["--no-sandbox", "--disable-dev-shm-usage", "--disable-blink-features=AutomationControlled"],
-            )
-            context = await browser.new_context(
-                accept_downloads=True,
-                viewport={"width": 1365, "height": 768},
-                user_agent=(
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/122.0.0.0 Safari/537.36"
-                ),
-            )
-            page = await context.new_page()
-
-            stage = "goto"
-            await page.goto(NMC_URL, wait_until="domcontentloaded", timeout=60000)
-            current_url = page.url
-
-            stage = "cookies"
-            await _accept_cookies_and_wait_enable_pin(page, out_dir_path, shots)
+        stage = "new_page"
+        page = await context.new_page()
 
-            stage = "fill_pin"
-            pin_input = page.locator("#PinNumber").first
-            await pin_input.scroll_into_view_if_needed(timeout=8000)
+        stage = "goto"
+        # Preloaded (cached) consent, so the cookie step's outcome can judge it
+        had_consent = await _has_consent_cookies(context)
+        # Don't block on late analytics/consent scripts; the cookie step waits for what it needs
+        try:
+            await page.goto(NMC_URL, wait_until="commit", timeout=15000)
+        except PlaywrightTimeoutError:
+            # A slow first byte isn't fatal; the cookie step's PIN wait decides
+            pass
+        current_url = page.url
+
+        stage = "cookies"
+        unlocked_by = await _accept_cookies_and_wait_enable_pin(page, steps)
+        if unlocked_by in ("banner", "api") or (unlocked_by == "ready" and not had_consent):
+            # Cookiebot registered consent itself (click, auto-accept observer or its API)
+            await _remember_consent(context)
+        elif unlocked_by in ("cookies", "forced") and had_consent:
+            # The preloaded consent didn't unlock the PIN; stop handing it to new contexts
+            _forget_consent()
+
+        stage = "fill_pin"
+        pin_input = page.locator("#PinNumber").first
+
+        # One-shot fill; fall back to typing like a user only if the value didn't stick
+        await pin_input.fill(pin, timeout=20000, force=True)
+
+        # Verify it actually went in; retry once if not
+        try:
+            val = await pin_input.input_value(timeout=2000)
+        except Exception:
+            val = ""
 
-            # Type like a user (more reliable than fill on some cookie-gated/JS-heavy pages)
-            await pin_input.click(timeout=20000, force=True)
+        if "".join((val or "").split()).upper() != pin:
+            await pin_input.click(timeout=10000, force=True)
             try:
                 await pin_input.press("Control+A")
             except Exception:
                 pass
-            await pin_input.type(pin, delay=60)
-
-            # Verify it actually went in; retry once if not
+            await pin_input.press_sequentially(pin)
             try:
                 val = await pin_input.input_value(timeout=2000)
             except Exception:
-                val = ""
-
-            if (val or "").strip().upper() != pin:
-                await pin_input.click(timeout=10000, force=True)
-                try:
-                    await pin_input.press("Control+A")
-                except Exception:
-                    pass
-                await pin_input.type(pin, delay=80)
+                val = "(failed to read)"
+            if "".join((val or "").split()).upper() != pin:
+                # Last resort: set the value in-page and fire the events the form listens for
+                val = await pin_input.evaluate(_SET_VALUE_JS, pin)
 
-            try:
-                notes.append(f"PIN readback after type: '{await pin_input.input_value(timeout=2000)}'")
-            except Exception:
-                notes.append("PIN readback after type: (failed to read)")
+        notes.append(f"PIN readback after fill: '{val}'")
 
-            await _save_shot(page, out_dir_path, "03_after_pin_fill", shots)
+        steps.mark(page, "03_after_pin_fill")
 
-            stage = "click_search"
-            search_btn = page.get_by_role("button", name=re.compile(r"^Search$", re.I)).first
-            await search_btn.scroll_into_view_if_needed(timeout=8000)
-            await search_btn.wait_for(state="visible", timeout=25000)
-            await search_btn.click(timeout=25000, force=True)
+        stage = "click_search"
+        search_btn = page.get_by_role("button", name=_SEARCH_BTN_RE).first
+        # Clicks scroll into view themselves; force skips the visibility wait, so keep that one
+        await search_btn.wait_for(state="visible", timeout=25000)
+        await search_btn.click(timeout=25000, force=True)
 
-            await page.wait_for_timeout(1200)
-            await _save_shot(page, out_dir_path, "04_after_search_click", shots)
+        steps.mark(page, "04_after_search_click")
 
-            stage = "wait_results"
-            try:
-                await page.get_by_text(re.compile(r"Your\s+search\s+returned", re.I)).first.wait_for(timeout=30000)
-            except Exception:
-                await page.get_by_role("link", name=re.compile(r"View\s+details", re.I)).first.wait_for(timeout=30000)
+        stage = "wait_results"
+        # One predicate for every terminal state, so a "no results" page ends the
+        # wait as soon as it renders instead of after the full timeout.
+        outcome = await (await page.wait_for_function(_RESULTS_STATE_JS, timeout=30000)).json_value()
+        if outcome == "none":
+            raise RuntimeError("NMC register search returned no results for this PIN")
 
-            await _save_shot(page, out_dir_path, "05_results_visible", shots)
+        steps.mark(page, "05_results_visible")
 
-            stage = "view_details"
-            view_details = page.get_by_role("link", name=re.compile(r"View\s+details", re.I)).first
-            await view_details.scroll_into_view_if_needed(timeout=8000)
-            await view_details.click(timeout=25000)
+        stage = "view_details"
+        view_details = page.get_by_role("link", name=_VIEW_DETAILS_RE).first
+        await view_details.click(timeout=25000)
 
-            await page.wait_for_timeout(900)
-            await _save_shot(page, out_dir_path, "06_details_modal", shots)
+        steps.mark(page, "06_details_modal")
 
-            stage = "extract_name"
-            name = await _extract_name_from_modal(page)
-            out_pdf = out_dir_path / f"{_sanitize_filename(name)} nmc check.pdf"
+        stage = "extract_name"
+        name = await _extract_name_from_modal(page)
+        out_pdf = out_dir_path / f"{_sanitize_filename(name)} nmc check.pdf"
 
-            stage = "download_pdf"
-            download_link = page.get_by_role("link", name=re.compile(r"Download\s+a\s+pdf", re.I)).first
-            await download_link.scroll_into_view_if_needed(timeout=8000)
+        stage = "download_pdf"
+        download_link = page.get_by_role("link", name=_DOWNLOAD_PDF_RE).first
+        # Resolve the link once; the clicks below then only need a short timeout
+        await download_link.wait_for(state="visible", timeout=8000)
 
+        # Fast path: when the link carries a real URL, fetch it over HTTP with the
+        # page's cookies instead of clicking and waiting for the download event.
+        fetched = False
+        try:
+            href = await download_link.get_attribute("href", timeout=3000)
+        except Exception:
+            href = None
+        if href and not href.lower().startswith(("javascript:", "#")):
+            pdf_url = urljoin(page.url, href)
             try:
-                async with page.expect_download(timeout=25000) as dl_info:
-                    await download_link.click(timeout=25000)
-                dl = await dl_info.value
-                await dl.save_as(str(out_pdf))
-            except PlaywrightTimeoutError:
-                await download_link.click(timeout=25000)
-                await page.wait_for_timeout(1500)
-                current_url = page.url
-                if "pdf=1" in current_url or current_url.lower().endswith(".pdf"):
-                    resp = await context.request.get(current_url, timeout=30000)
-                    if resp.ok:
-                        out_pdf.write_bytes(await resp.body())
-                    else:
-                        raise RuntimeError(f"PDF fetch failed: HTTP {resp.status}")
+                resp = await context.request.get(pdf_url, headers=_PDF_HEADERS, timeout=30000)
+                body = await resp.body() if resp.ok else b""
+                if body[:5] == b"%PDF-":
+                    out_pdf.write_bytes(body)
+                    fetched = True
                 else:
-                    raise RuntimeError("Download did not trigger and PDF URL not detected")
-
-            await browser.close()
-
-            if out_pdf.exists() and out_pdf.stat().st_size > 2000:
-                return {"ok": True, "pdf_path": str(out_pdf), "name": name, "stage": "done"}
-
-            raise RuntimeError("Downloaded PDF missing or too small")
+                    notes.append(f"Direct PDF fetch not usable: HTTP {resp.status} {pdf_url}")
+            except Exception as e:
+                notes.append(f"Direct PDF fetch failed: {type(e).__name__}: {e}")
+
+        if not fetched:
+            # One click, then take whichever arrives first: a download, or a PDF the
+            # browser renders inline (same tab or a popup). Only this tab and its own
+            # popups are listened to, not the whole context. A popup reported with
+            # the PDF already loaded resolves to its URL instead.
+            popups = []
+            inline_pdf = asyncio.get_running_loop().create_future()
+
+            def on_response(resp) -> None:
+                if not inline_pdf.done() and _is_inline_pdf_response(resp):
+                    inline_pdf.set_result(resp)
+
+            def keep_popup(p) -> None:
+                popups.append(p)
+                p.on("response", on_response)
+                if not inline_pdf.done() and ("pdf=1" in p.url or p.url.lower().endswith(".pdf")):
+                    inline_pdf.set_result(p.url)
+
+            page.on("popup", keep_popup)
+            page.on("response", on_response)
+            dl_task = asyncio.ensure_future(page.wait_for_event("download", timeout=15000))
+            resp_task = asyncio.ensure_future(asyncio.wait_for(inline_pdf, 15))
+            winner = None
+            try:
+                await download_link.click(timeout=5000)
+                pending = {dl_task, resp_task}
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for t in done:
+                        if t.exception() is None and winner is None:
+                            winner = t
+
+                saved = False
+                popup_url = None
+                fallback_url = None
+                if winner is resp_task:
+                    got = resp_task.result()
+                    if isinstance(got, str):
+                        popup_url = fallback_url = got
+                    else:
+                        current_url = fallback_url = got.url
+                        # Chromium sometimes turns the inline navigation into a download,
+                        # and then the body isn't available
+                        try:
+                            body = await got.body()
+                        except Exception as e:
+                            body = b""
+                            notes.append(f"Inline PDF body unavailable: {type(e).__name__}: {e}")
+                        if body[:4] == b"%PDF":
+                            out_pdf.write_bytes(body)
+                            saved = True
+
+                if not saved and popup_url is None:
+                    # The download (if it won, or is still on its way)
+                    try:
+                        dl = await dl_task
+                        fallback_url = fallback_url or dl.url
+                        await dl.save_as(str(out_pdf))
+                        saved = True
+                    except Exception:
+                        pass
+
+                if not saved:
+                    current_url = fallback_url or (popups[-1].url if popups else page.url)
+                    if "pdf=1" in current_url or current_url.lower().endswith(".pdf"):
+                        resp = await context.request.get(current_url, headers=_PDF_HEADERS, timeout=30000)
+                        body = await resp.body() if resp.ok else b""
+                        if body[:4] != b"%PDF":
+                            raise RuntimeError(f"PDF fetch failed: HTTP {resp.status} {current_url}")
+                        out_pdf.write_bytes(body)
+                    else:
+                        raise RuntimeError("Download did not trigger and PDF URL not detected")
+            finally:
+                for t in (dl_task, resp_task):
+                    if not t.done():
+                        t.cancel()
+                    elif not t.cancelled():
+                        t.exception()
+                page.remove_listener("popup", keep_popup)
+                page.remove_listener("response", on_response)
+                for p in popups:
+                    await _close_quietly(p)
+
+        if out_pdf.exists() and out_pdf.stat().st_size > 2000:
+            return {"ok": True, "pdf_path": str(out_pdf), "name": name, "stage": "done"}
+
+        raise RuntimeError("Downloaded PDF missing or too small")
 
     except Exception as e:
-        try:
-            snap = out_dir_path / f"NMC-Snapshot-{int(time.time())}.pdf"
-            _make_snapshot_pdf(
-                snap,
-                url=current_url,
-                stage=stage,
-                notes=notes + [f"Error: {type(e).__name__}: {e}"],
-                image_paths=shots,
-            )
-            return {"ok": False, "pdf_path": str(snap), "stage": stage, "error": str(e), "url": current_url}
-        except Exception:
-            out = out_dir_path / f"NMC-Error-{int(time.time())}.pdf"
-            make_simple_error_pdf(out, "NMC check failed", [f"Stage: {stage}", str(e)])
-            return {"ok": False, "pdf_path": str(out), "stage": stage, "error": str(e), "url": current_url}
+        shots = []
+        if page is not None:
+            try:
+                cue = await page.evaluate(_BOT_CHECK_JS, [_CAPTCHA_SEL, _BOT_TEXT_CUES])
+                if cue:
+                    notes.append(f"Bot challenge detected on the page ({cue}).")
+            except Exception:
+                pass
+            shots = await _failure_shot(page, out_dir_path, notes)
+        notes = notes + [f"Error: {type(e).__name__}: {e}", "", "Steps reached:"] + steps.lines()
+        return _failure_result(out_dir_path, stage=stage, url=current_url, notes=notes, shots=shots, error=e)
+    finally:
+        if page is not None:
+            _track(asyncio.create_task(_close_quietly(page)))
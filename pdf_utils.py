@@ -1,5 +1,6 @@
+import io
 from pathlib import Path
-from typing import Iterable, List
+from typing import BinaryIO, Iterable, List, Union
 
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -8,8 +9,18 @@ from reportlab.pdfgen import canvas
 def make_simple_error_pdf(out_path: Path, title: str, lines: List[str]) -> None:
     out_path = Path(out_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    _draw_simple_error_pdf(str(out_path), title, lines)
 
-    c = canvas.Canvas(str(out_path), pagesize=A4)
+
+def make_simple_error_pdf_bytes(title: str, lines: List[str]) -> bytes:
+    """Same as make_simple_error_pdf, but rendered in memory."""
+    buf = io.BytesIO()
+    _draw_simple_error_pdf(buf, title, lines)
+    return buf.getvalue()
+
+
+def _draw_simple_error_pdf(target: Union[str, BinaryIO], title: str, lines: List[str]) -> None:
+    c = canvas.Canvas(target, pagesize=A4)
     width, height = A4
 
     y = height - 72